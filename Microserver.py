@@ -1,25 +1,40 @@
 
+from detection import Transform, Detector, Trackers, Counter, Horizon, load_names
+from visualization import draw
+from latency import LatencyBudget
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from threading import Thread
 import threading
 import socket
 import json
+import time
 import cv2
 
 
 class Microserver:
     
-    def __init__(self, ip, port, thread, listen=1, buffer=1024):
+    def __init__(self, ip, port, thread, listen=1, buffer=1024, preview_port=None):
+        
+        '''
+            preview_port:   If set, annotated frames of the thread are
+                            served as MJPEG on http://ip:preview_port/
+        '''
         
         assert isinstance(ip,   str), 'IP must be a string.'
         assert isinstance(port, int), 'PORT must be a int.'
         assert 1024 < port < 65536,   'PORT must be in (1024, 65536) interval.'
         
-        self.ip     = ip
-        self.port   = port
-        self.alive  = True
-        self.buffer = buffer
-        self.thread = thread
-        self.sock   = self.create_socket(ip, port, listen)
+        self.ip      = ip
+        self.port    = port
+        self.alive   = True
+        self.buffer  = buffer
+        self.thread  = thread
+        self.sock    = self.create_socket(ip, port, listen)
+        self.preview = None
+        
+        if preview_port is not None:
+            self.preview = Preview(ip, preview_port, thread)
+            self.preview.start()
         
         self.start()
     
@@ -83,7 +98,13 @@ class Microserver:
                 
                 if command == 1:
                     current = self.thread.current
-                    message = self.create_message({'current': current})
+                    message = self.create_message({
+                        'current' : current,
+                        'upward'  : self.thread.counter.upward,
+                        'downward': self.thread.counter.downward,
+                        'classes' : self.thread.counter.counts,
+                        'latency' : self.thread.budget.stats(),
+                    })
                     clientsocket.send(message)
 
                 elif command == 2:
@@ -106,11 +127,79 @@ class Microserver:
         self.alive = False
         self.thread.stop()
         self.sock.close()
+        
+        if self.preview is not None:
+            self.preview.stop()
     
     def __exit__(self, type, value, traceback):
         self.alive = False
         self.thread.stop()
         self.sock.close()
+        
+        if self.preview is not None:
+            self.preview.stop()
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    
+    def do_GET(self):
+        
+        if self.client_address[0] != '127.0.0.1':
+            self.send_error(403)
+            return
+        
+        if self.path != '/':
+            self.send_error(404)
+            return
+        
+        stream = self.server.stream
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        
+        # Stream renders and encodes frames only while somebody watches
+        stream.watch()
+        number = -1
+        
+        try:
+            while stream.alive:
+                jpeg, number = stream.wait_preview(number)
+                
+                if jpeg is None:
+                    continue
+                
+                header = 'Content-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(jpeg)
+                self.wfile.write(b'--frame\r\n' + bytes(header, 'utf8'))
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            stream.unwatch()
+    
+    def log_message(self, format, *args):
+        pass
+
+class Preview(Thread):
+    
+    def __init__(self, ip, port, stream):
+        
+        assert isinstance(port, int), 'PORT must be a int.'
+        assert 1024 < port < 65536,   'PORT must be in (1024, 65536) interval.'
+        
+        Thread.__init__(self, name='Preview', daemon=True)
+        
+        self.server = ThreadingHTTPServer((ip, port), PreviewHandler)
+        self.server.daemon_threads = True
+        self.server.stream         = stream
+    
+    def run(self):
+        self.server.serve_forever()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
 
 class AsyncCapture(Thread):
     
@@ -125,15 +214,20 @@ class AsyncCapture(Thread):
         self.lock    = threading.Lock()
         self.grab    = False
         self.frame   = None
+        self.stamp   = None
+        self.number  = -1
         self.alive   = True
     
     def run(self):
         while self.alive:
             grab, frame = self.capture.read()
+            stamp       = time.monotonic()
             
             with self.lock:
-                self.grab  = grab
-                self.frame = frame
+                self.grab    = grab
+                self.frame   = frame
+                self.stamp   = stamp
+                self.number += 1
     
     def read(self):
         with self.lock:
@@ -141,6 +235,21 @@ class AsyncCapture(Thread):
             frame = self.frame
         return grab, frame
     
+    def read_stamped(self):
+        
+        '''
+            Returns grab, frame, time.monotonic() of the capture
+            and number of the frame. The number shows whether
+            the frame was already read.
+        '''
+        
+        with self.lock:
+            grab   = self.grab
+            frame  = self.frame
+            stamp  = self.stamp
+            number = self.number
+        return grab, frame, stamp, number
+    
     def isOpened(self):
         return self.capture.isOpened()
     
@@ -153,23 +262,166 @@ class AsyncCapture(Thread):
 
 class Stream(Thread):
     
-    def __init__(self, rtsp, points, weight, cfg):
+    def __init__(self, rtsp, boundary, weights, config, fragment=None, size=608,
+                 target=None, drop_n_frames=25, threshold=0.6, checker=Horizon,
+                 tracking_scale=1.0, budget=None, output=None, preview_size=(640, 360),
+                 preview_fps=5, thresholds=None, pool=None, names='yolo/coco.json'):
+        
+        '''
+            rtsp:           RTSP address of the camera.
+            
+            boundary:       Array of points (left, top, right, bottom).
+            
+            fragment:       See Transform.
+            
+            checker:        Horizon or Vertical.
+            
+            budget:         Float. Latency budget in seconds, see LatencyBudget.
+            
+            output:         Path to mp4 with annotated frames. Rendering
+                            is the first work dropped when over the budget.
+            
+            preview_size:   Resolution (width, height) of the MJPEG preview.
+            
+            preview_fps:    Maximum frame rate of the MJPEG preview.
+            
+            thresholds:     Dict {object id: threshold}, see Detector.
+            
+            pool:           DetectorPool shared by all streams of the process.
+                            Its size must match SIZE, its target and thresholds
+                            are used instead of those given here. The pool is
+                            closed by its owner, not by the stream.
+                            None runs the network in this process.
+            
+            names:          Path to JSON {object id: name}, see load_names.
+        '''
         
         Thread.__init__(self, name='Stream')
         
-        self.detector  = Detector(weight, cfg)
-        self.transform = Transform(points)
+        self.capture   = AsyncCapture(rtsp)
+        width          = int(self.capture.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height         = int(self.capture.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        
+        if pool is not None:
+            self.detector = pool
+        else:
+            self.detector = Detector(weights, config, target=target, thresholds=thresholds)
+        
+        self.transform = Transform([width, height], size=size, fragment=fragment)
+        self.boundary  = boundary
+        self.counter   = Counter(self.transform, checker(boundary), Trackers(scale=tracking_scale),
+                                 names=load_names(names))
+        self.budget    = LatencyBudget(budget)
+        self.drop      = drop_n_frames
+        self.threshold = threshold
+        self.boxes     = {}
         self.alive     = True
         self.current   = 0
+        self.last      = -1
+        self.writer    = None
         
-        self.capture   = AsyncCapture(rtsp)
+        self.preview_size   = tuple(preview_size)
+        self.preview_period = 1 / preview_fps
+        self.preview_time   = 0
+        self.preview_number = 0
+        self.jpeg           = None
+        self.viewers        = 0
+        self.condition      = threading.Condition()
+        
+        if output is not None:
+            fourcc      = cv2.VideoWriter_fourcc(*'mp4v')
+            frame_rate  = self.capture.capture.get(cv2.CAP_PROP_FPS) or 25.0
+            self.writer = cv2.VideoWriter(output, fourcc, frame_rate, (width, height))
+        
+        self.detector.warmup(size)
         self.capture.start()
+    
+    def render(self, frame):
+        lines = [
+            f'{self.counter.upward_label}:   {self.counter.upward}',
+            f'{self.counter.downward_label}: {self.counter.downward}',
+        ]
+        return draw(frame, self.boundary, self.boxes.values(), lines)
+    
+    def process(self, frame):
+        interval = self.budget.detect_interval(self.drop)
+        
+        if self.current % interval == 0:
+            blob     = self.transform(frame)
+            detected = self.detector(blob, self.threshold)
+            self.counter.detect(frame, detected)
+        
+        if self.budget.should_track(self.current):
+            self.boxes = self.counter.update(frame)
+        
+        # Frames are rendered only for the mp4 or for preview viewers
+        now     = time.monotonic()
+        watched = self.viewers > 0 and now - self.preview_time >= self.preview_period
+        write   = self.writer is not None
+        
+        if (watched or write) and self.budget.render:
+            over = self.render(frame)
+            
+            if write:
+                self.writer.write(over)
+            
+            if watched:
+                self.preview_time = now
+                self.publish(over)
+    
+    def publish(self, frame):
+        resized  = cv2.resize(frame, self.preview_size, interpolation=cv2.INTER_AREA)
+        _, jpeg  = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        
+        with self.condition:
+            self.jpeg            = jpeg.tobytes()
+            self.preview_number += 1
+            self.condition.notify_all()
+    
+    def watch(self):
+        with self.condition:
+            self.viewers += 1
+    
+    def unwatch(self):
+        with self.condition:
+            self.viewers -= 1
+            
+            if self.viewers == 0:
+                self.jpeg = None
+    
+    def wait_preview(self, number, timeout=1):
+        
+        '''
+            Waits for a preview newer than the number.
+            Returns jpeg bytes (None on timeout) and its number.
+        '''
+        
+        with self.condition:
+            fresh = lambda: self.preview_number != number and self.jpeg is not None
+            
+            if not self.condition.wait_for(fresh, timeout):
+                return None, number
+            
+            return self.jpeg, self.preview_number
         
     def run(self):
         while self.alive:
-            grab, frame = self.capture.read()
+            grab, frame, stamp, number = self.capture.read_stamped()
+            
+            # The capture keeps only the newest frame, so frames,
+            # which arrived while the previous one was processed,
+            # are skipped. Here we only wait for a new one.
+            if not grab or number == self.last:
+                time.sleep(0.005)
+                continue
+            
+            self.last = number
+            self.process(frame)
+            self.budget.observe(stamp)
             self.current += 1
-            time.sleep(1)
+        
+        if self.writer is not None:
+            self.writer.release()
             
     def stop(self):
         self.alive = False
@@ -178,5 +430,3 @@ class Stream(Thread):
     def __exit__(self):
         self.alive = False
         self.capture.stop()
-
-
@@ -0,0 +1,287 @@
+from detection import Detector
+import numpy as np
+import hashlib
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+#===========================#
+#                           #
+#         Classes           #
+#                           #
+#===========================#
+
+class DetectionCache:
+
+    # index, confidence, left, top, width, height
+    columns     = 6
+    flush_every = 1000
+
+    def __init__(self, root, video, threshold=0.3, record=False, **settings):
+
+        '''
+            root:       Directory with caches.
+
+            video:      Path to video. Its size and modification
+                        time are a part of the key.
+
+            threshold:  Float. Detections are recorded with this
+                        threshold before NMS, so any replay threshold
+                        above it gives the same result as the network.
+
+            record:     If False, the cache is only replayed and its
+                        files are never changed. If True, new frames
+                        can be written. Only one process at a time
+                        can record a cache.
+
+            settings:   Everything else that changes detector output
+                        (weights, config, size, fragment, shape, target).
+                        Must be JSON serializable.
+        '''
+
+        self.key       = self.create_key(video, threshold, settings)
+        digest         = json.dumps(self.key, sort_keys=True)
+        digest         = hashlib.sha1(bytes(digest, 'utf8')).hexdigest()
+        self.path      = os.path.join(root, digest[:16])
+        self.threshold = threshold
+        self.record    = record
+
+        self.index_path   = os.path.join(self.path, 'index.npy')
+        self.records_path = os.path.join(self.path, 'records.bin')
+        self.meta_path    = os.path.join(self.path, 'meta.json')
+        self.lock_path    = os.path.join(self.path, 'lock')
+
+        self.added   = {}
+        self.records = None
+        self.writer  = None
+        self.lock    = None
+        self.rows    = 0
+
+        if record:
+            os.makedirs(self.path, exist_ok=True)
+            self.lock = self.acquire()
+
+            with open(self.meta_path, 'w') as file:
+                json.dump(self.key, file, indent=4)
+
+        # index[frame] = (first record, number of records).
+        # Frames that were never detected have -1 records.
+        self.index = self.load_index()
+
+        if record:
+            self.rows = self.count_rows()
+
+    def create_key(self, video, threshold, settings):
+        stat = os.stat(video)
+        key  = {
+            'video'    : os.path.abspath(video),
+            'bytes'    : stat.st_size,
+            'mtime'    : int(stat.st_mtime),
+            'threshold': threshold,
+        }
+        key.update(settings)
+        return key
+
+    def acquire(self):
+
+        # The lock is held until close(). The system releases it
+        # if the process dies, so a crash never leaves a stale lock
+        lock = open(self.lock_path, 'w')
+
+        if fcntl is None:
+            return lock
+
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            raise RuntimeError(f'Cache {self.path} is recorded by another process.')
+
+        return lock
+
+    def load_index(self):
+        if os.path.exists(self.index_path):
+            return np.load(self.index_path, mmap_mode='r')
+
+        return np.zeros((0, 2), dtype=np.int64)
+
+    def count_rows(self):
+        row     = self.columns * np.dtype(np.float32).itemsize
+        indexed = self.index[self.index[:, 1] > 0]
+        rows    = int((indexed[:, 0] + indexed[:, 1]).max()) if len(indexed) else 0
+
+        # Rows after the last indexed one come from an interrupted run
+        # and may end with a partial row. They are cut off, so new rows
+        # are appended exactly where the index expects them. This is
+        # safe only under the lock: nobody else is appending now.
+        if os.path.exists(self.records_path) and os.path.getsize(self.records_path) > rows * row:
+            with open(self.records_path, 'r+b') as file:
+                file.truncate(rows * row)
+
+        return rows
+
+    def locate(self, frame):
+        if frame in self.added:
+            return self.added[frame]
+
+        if frame < len(self.index):
+            start, count = self.index[frame]
+            return int(start), int(count)
+
+        return None, -1
+
+    def covers(self, frames):
+        return all(frame in self for frame in frames)
+
+    def read(self, frame):
+
+        '''
+            Returns output of Detector.decode for the frame.
+        '''
+
+        start, count = self.locate(frame)
+
+        if count < 0:
+            raise KeyError(f'Frame {frame} is not cached.')
+
+        # Nothing to map: records.bin may even be empty
+        if count == 0:
+            return [], [], []
+
+        if self.writer is not None:
+            self.writer.flush()
+
+        if self.records is None or start + count > len(self.records):
+            self.records = np.memmap(self.records_path, dtype=np.float32, mode='r')
+            self.records = self.records.reshape(-1, self.columns)
+
+        rows    = self.records[start: start + count]
+        indices = [int(row[0]) for row in rows]
+        confs   = [float(row[1]) for row in rows]
+        sizes   = [[int(value) for value in row[2:]] for row in rows]
+        return indices, sizes, confs
+
+    def write(self, frame, detections):
+
+        '''
+            detections: Output of Detector.decode.
+        '''
+
+        assert self.record, 'Cache is opened without RECORD.'
+
+        indices, sizes, confs = detections
+        rows = np.zeros((len(indices), self.columns), dtype=np.float32)
+
+        for i, (index, size, conf) in enumerate(zip(indices, sizes, confs)):
+            rows[i, 0]  = index
+            rows[i, 1]  = conf
+            rows[i, 2:] = size
+
+        if self.writer is None:
+            self.writer = open(self.records_path, 'ab')
+
+        self.writer.write(rows.tobytes())
+        self.added.update({frame: (self.rows, len(rows))})
+        self.rows += len(rows)
+
+        # Keep the index on disk reasonably fresh,
+        # so an interrupted run loses little work
+        if len(self.added) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+        if not self.added:
+            return
+
+        length = max(len(self.index), max(self.added) + 1)
+        index  = np.full((length, 2), -1, dtype=np.int64)
+        index[:len(self.index)] = self.index
+
+        for frame, (start, count) in self.added.items():
+            index[frame] = (start, count)
+
+        # Write to a temporary file first, so an interrupted
+        # run never leaves a broken index behind
+        temporary = self.index_path + '.tmp'
+
+        with open(temporary, 'wb') as file:
+            np.save(file, index)
+
+        os.replace(temporary, self.index_path)
+        self.index = self.load_index()
+        self.added = {}
+
+    def close(self):
+        self.flush()
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+    def replay(self, detections, threshold=0.6, nms_threshold=0.4, thresholds=None):
+
+        '''
+            Applies the real thresholds and NMS to detections
+            recorded with the cache threshold.
+
+            thresholds: Dict {object id: threshold}, see Detector.
+        '''
+
+        thresholds = thresholds or {}
+        lowest     = min([threshold, *thresholds.values()])
+
+        assert lowest >= self.threshold, 'THRESHOLD is lower than the cached one.'
+
+        indices, sizes, confs = detections
+        keep       = [i for i, (index, conf) in enumerate(zip(indices, confs))
+                      if conf > thresholds.get(index, threshold)]
+        detections = (
+            [indices[i] for i in keep],
+            [sizes[i] for i in keep],
+            [confs[i] for i in keep],
+        )
+        return Detector.select(detections, lowest, nms_threshold)
+
+    def __contains__(self, frame):
+        return self.locate(frame)[1] >= 0
+
+    def __call__(self, frame, threshold=0.6, nms_threshold=0.4, thresholds=None):
+
+        '''
+            Replays the detector: same output as Detector.__call__.
+        '''
+
+        detections = self.read(frame)
+        return self.replay(detections, threshold, nms_threshold, thresholds)
+
+    def __getstate__(self):
+
+        # Other processes map the same files instead of receiving
+        # a copy of the detections. They only replay, the lock stays here
+        self.flush()
+        state = self.__dict__.copy()
+        state.update({'index': None, 'records': None, 'writer': None,
+                      'lock': None, 'record': False})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = self.load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
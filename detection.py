@@ -1,8 +1,87 @@
-from shapely import geometry
 import numpy as np
+import threading
+import json
 import math
+import time
 import cv2
 
+#===========================#
+#                           #
+#         Constants         #
+#                           #
+#===========================#
+
+# Input sizes supported by the yolo configs (multiples of 32)
+PROFILES = (320, 416, 512, 608)
+
+BACKENDS = {
+    'opencv'           : 'DNN_BACKEND_OPENCV',
+    'inference_engine' : 'DNN_BACKEND_INFERENCE_ENGINE',
+    'cuda'             : 'DNN_BACKEND_CUDA',
+}
+
+TARGETS = {
+    ('cpu',    'fp32'): 'DNN_TARGET_CPU',
+    ('cpu',    'fp16'): 'DNN_TARGET_CPU_FP16',
+    ('opencl', 'fp32'): 'DNN_TARGET_OPENCL',
+    ('opencl', 'fp16'): 'DNN_TARGET_OPENCL_FP16',
+    ('cuda',   'fp32'): 'DNN_TARGET_CUDA',
+    ('cuda',   'fp16'): 'DNN_TARGET_CUDA_FP16',
+}
+
+# Networks loaded in this process, keyed by (config, weights, backend, target)
+networks = {}
+
+# shapely.geometry, imported on first use (see get_geometry)
+geometry = None
+
+# Trackers of opencv-contrib. Newer versions keep some of them in cv2.legacy
+TRACKERS = {
+    'csrt'       : 'TrackerCSRT_create',
+    'kcf'        : 'TrackerKCF_create',
+    'mosse'      : 'TrackerMOSSE_create',
+    'medianflow' : 'TrackerMedianFlow_create',
+}
+
+#===========================#
+#                           #
+#         Functions         #
+#                           #
+#===========================#
+
+def load_names(path='yolo/coco.json'):
+
+    '''
+        Returns dict {object id: name}.
+    '''
+
+    with open(path) as file:
+        names = json.load(file)
+
+    return {int(index): name for index, name in names.items()}
+
+def create_tracker(name='csrt'):
+    assert name in TRACKERS, 'Unknown TRACKER.'
+
+    factory = getattr(cv2, TRACKERS[name], None)
+
+    if factory is None:
+        factory = getattr(cv2.legacy, TRACKERS[name])
+
+    return factory()
+
+def get_geometry():
+
+    # shapely is slow to import, so it is loaded only
+    # when the first boxes are matched and then reused
+    global geometry
+
+    if geometry is None:
+        from shapely import geometry as module
+        geometry = module
+
+    return geometry
+
 #===========================#
 #                           #
 #         Classes           #
@@ -19,10 +98,13 @@ class Transform:
             fragment:   Array of points (left, top, right, bottom).
                         If framgment is not None, Image will be cropped.
 
-            size:       Integer (512, 608). Required.
+            size:       Integer (320, 416, 512, 608). Required.
                         Image will be resized to square.
+                        Must match the size used by Detector.warmup.
         '''
 
+        assert size in PROFILES, 'SIZE must be one of PROFILES.'
+
         self.fragment   = fragment
         self.shape      = shape
         self.size       = size
@@ -87,7 +169,8 @@ class Transform:
 
 class Detector:
 
-    def __init__(self, weights, config, target=None):
+    def __init__(self, weights, config, target=None, backend='opencv',
+                 device='cpu', precision='fp32', thresholds=None):
 
         '''
             weights:    Path to yolo.weights
@@ -95,55 +178,155 @@ class Detector:
             config:     Path to yolo.cfg
 
             target:     Array of object id.
+
+            thresholds: Dict {object id: threshold}. Objects without
+                        own threshold use the threshold of __call__.
+                        String ids ("2") are converted to integers.
+
+            backend:    String ('opencv', 'inference_engine', 'cuda').
+                        If the installed cv2 has no such backend,
+                        opencv on cpu is used.
+
+            device:     String ('cpu', 'opencl', 'cuda').
+
+            precision:  String ('fp32', 'fp16'). If the installed cv2 has
+                        no fp16 target for the device, fp32 is used.
+                        If it has no target for the device at all,
+                        opencv on cpu is used.
+
+            The setup actually used is in backend, device and precision
+            (see describe). A fallback is reported when the network is loaded.
         '''
 
-        self.net    = cv2.dnn.readNetFromDarknet(config, weights)
-        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-        self.layers = self.getOutputsNames(self.net)
-        self.target = target
+        assert backend in BACKENDS,            'Unknown BACKEND.'
+        assert (device, precision) in TARGETS, 'Unknown DEVICE or PRECISION.'
+
+        self.requested = (backend, device, precision)
+
+        if not hasattr(cv2.dnn, BACKENDS[backend]):
+            backend = 'opencv'
+            device  = 'cpu'
+
+        if not hasattr(cv2.dnn, TARGETS[(device, precision)]):
+            precision = 'fp32'
+
+        # Only the opencv backend runs on cpu in every build
+        if not hasattr(cv2.dnn, TARGETS[(device, precision)]):
+            backend = 'opencv'
+            device  = 'cpu'
+
+        self.backend    = backend
+        self.device     = device
+        self.precision  = precision
+
+        if self.requested != (backend, device, precision):
+            print(f'cv2 {cv2.__version__} has no {"/".join(self.requested)}, '
+                  f'using {self.describe()}')
+
+        self.net, self.lock = self.load_network(weights, config)
+        self.layers     = self.getOutputsNames(self.net)
+        self.target     = target
+        # Keys from JSON configs are strings
+        self.thresholds = {int(index): value for index, value in (thresholds or {}).items()}
+
+    def describe(self):
+        return f'{self.backend}/{self.device}/{self.precision}'
+
+    def load_network(self, weights, config):
+        backend = getattr(cv2.dnn, BACKENDS[self.backend])
+        target  = getattr(cv2.dnn, TARGETS[(self.device, self.precision)])
+        key     = (config, weights, backend, target)
+
+        # Parsing darknet files takes seconds, so the network
+        # is loaded once per process and reused by every Detector.
+        # The lock guards the shared network between threads.
+        if key not in networks:
+            net = cv2.dnn.readNetFromDarknet(config, weights)
+            net.setPreferableBackend(backend)
+            net.setPreferableTarget(target)
+            networks.update({key: (net, threading.Lock())})
+
+        return networks[key]
 
     def getOutputsNames(self, net):
         layersNames = net.getLayerNames()
-        return [layersNames[i[0] - 1] for i in net.getUnconnectedOutLayers()]
+        # cv2 >= 4.5.4 returns a flat array instead of [[i], ...]
+        outputs     = np.array(net.getUnconnectedOutLayers()).flatten()
+        return [layersNames[i - 1] for i in outputs]
+
+    def warmup(self, size=608):
+        blob = np.zeros((1, 3, size, size), dtype=np.float32)
+        self.detect(blob)
+
+    def benchmark(self, sizes=PROFILES, repeats=5):
+        '''
+            Returns dict {size: ms per forward pass}.
+        '''
+
+        results = {}
+
+        for size in sizes:
+            blob  = np.random.rand(1, 3, size, size).astype(np.float32)
+            self.detect(blob)
+            start = time.perf_counter()
+
+            for _ in range(repeats):
+                self.detect(blob)
+
+            elapsed = time.perf_counter() - start
+            results.update({size: elapsed * 1000 / repeats})
+
+        return results
 
     def detect(self, blob):
-        self.net.setInput(blob)
-        detections = self.net.forward(self.layers)
+        with self.lock:
+            self.net.setInput(blob)
+            detections = self.net.forward(self.layers)
         return detections
 
-    def sort_detections(self, detections, shape, threshold):
+    def get_thresholds(self, classes, threshold, thresholds=None):
+        limits = np.full(len(classes), threshold, dtype=np.float64)
+
+        for index, limit in (thresholds or {}).items():
+            limits[classes == index] = limit
+
+        return limits
+
+    def sort_detections(self, detections, shape, threshold, thresholds=None):
         confidences = []
         indices     = []
         boxes       = []
         width       = shape[0]
         height      = shape[1]
-        
-        for detection in detections[0]:
-            scores = detection[5:]
-            index  = np.argmax(scores)
-            conf   = scores[index]
+        output      = detections[0]
+        scores      = output[:, 5:]
+        classes     = np.argmax(scores, axis=1)
+        confs       = scores[np.arange(len(output)), classes]
 
-            if self.target != None:
-                if index not in self.target:
-                    continue
+        # Rejecting low confidence and foreign classes at once is much
+        # cheaper than checking every row, and leaves less work for NMS
+        keep        = confs > self.get_thresholds(classes, threshold, thresholds)
+
+        if self.target != None:
+            keep &= np.isin(classes, self.target)
+        
+        for detection, index, conf in zip(output[keep], classes[keep], confs[keep]):
+            center_x = int(detection[0] * width)      
+            center_y = int(detection[1] * height)
+            w        = int(detection[2] * width)
+            h        = int(detection[3] * height)
+            left     = int(center_x - w / 2)
+            top      = int(center_y - h / 2)
+            box      = [left, top, w, h]
             
-            if conf > threshold:
-                center_x = int(detection[0] * width)      
-                center_y = int(detection[1] * height)
-                w        = int(detection[2] * width)
-                h        = int(detection[3] * height)
-                left     = int(center_x - w / 2)
-                top      = int(center_y - h / 2)
-                box      = [left, top, w, h]
-                
-                boxes.append(box)
-                indices.append(index)
-                confidences.append(conf)
+            boxes.append(box)
+            indices.append(int(index))
+            confidences.append(conf)
                 
         return indices, boxes, confidences
 
-    def remove_intersections(self, detections, conf_thr, nms_thr=0.4):
+    @staticmethod
+    def remove_intersections(detections, conf_thr, nms_thr=0.4):
         boxes       = detections[1]
         handler     = lambda x: float(x)
         confidences = list(map(handler, detections[2]))
@@ -153,53 +336,92 @@ class Detector:
         new_confs   = []
         new_indices = []
 
-        for index in indices:
-            i = index[0]
+        # cv2 >= 4.5.4 returns a flat array instead of [[i], ...]
+        for i in np.array(indices, dtype=np.int64).flatten():
             new_boxes.append(boxes[i])
             new_confs.append(confidences[i])
             new_indices.append(detections[0][i])
 
         return new_indices, new_boxes, new_confs
 
-    def convert_size_to_box(self, size):
+    @staticmethod
+    def convert_size_to_box(size):
         left, top, width, height = map(lambda x: int(x), size)
         right                    = left + width
         bottom                   = top + height
         box    = [left, top, right, bottom]
         return box
 
-    def convert_sizes_to_boxes(self, sizes):
+    @staticmethod
+    def convert_sizes_to_boxes(sizes):
         boxes = []
         for size in sizes:
-            box = self.convert_size_to_box(size)
+            box = Detector.convert_size_to_box(size)
             boxes.append(box)
         return boxes
 
-    def __call__(self, blob, threshold=0.6):
+    def decode(self, blob, threshold=0.6, thresholds=None):
+
+        '''
+            Returns detections before NMS: indices, sizes
+            [left, top, width, height] and confidences.
+
+            thresholds: Dict {object id: threshold}. Overrides
+                        threshold for these objects.
+        '''
+
         height     = blob[0][0].shape[0]
         width      = blob[0][0].shape[1]
         shape      = [width, height]
         detections = self.detect(blob)
-        detections = self.sort_detections(detections, shape, threshold)
-        indices, boxes, confs = self.remove_intersections(detections, threshold)
-        boxes      = self.convert_sizes_to_boxes(boxes)
+        detections = self.sort_detections(detections, shape, threshold, thresholds)
+        return detections
+
+    @staticmethod
+    def select(detections, threshold=0.6, nms_threshold=0.4):
+
+        '''
+            Applies NMS to output of Detector.decode.
+            Does not need the network, so it also works
+            for detections read from DetectionCache.
+        '''
+
+        indices, boxes, confs = Detector.remove_intersections(detections, threshold, nms_threshold)
+        boxes      = Detector.convert_sizes_to_boxes(boxes)
         return indices, boxes, confs
 
+    def __call__(self, blob, threshold=0.6, nms_threshold=0.4):
+        detections = self.decode(blob, threshold, self.thresholds)
+        lowest     = min([threshold, *self.thresholds.values()])
+        return self.select(detections, lowest, nms_threshold)
+
 class Trackers:
 
-    def __init__(self):
+    def __init__(self, scale=1.0):
         '''
             directions: Dict of angles (360-degree).
 
             previous:   Dict of previous positions [left, top, right, bottom].
 
             trackers:   Dict of trackers.
+
+            classes:    Dict of object ids (None if unknown).
+
+            scale:      Float in (0, 1]. Trackers work on a frame resized
+                        by this factor. Boxes are returned in the
+                        coordinates of the original frame.
         '''
 
+        assert 0 < scale <= 1, 'SCALE must be in (0, 1] interval.'
+
         self.directions  = {}
         self.previous    = {}
         self.trackers    = {}
+        self.classes     = {}
         self.index       = 0
+        self.scale       = scale
+        self.frame       = None
+        self.scaled      = None
 
     def create_index(self):
         index       = self.index
@@ -255,6 +477,7 @@ class Trackers:
             return 360 - angle
 
     def get_area_of_intersection(self, updated, detected):
+        geometry     = get_geometry()
         u_rectangle  = geometry.box(*updated)
         d_rectangle  = geometry.box(*detected)
         intersection = u_rectangle.intersection(d_rectangle)
@@ -292,20 +515,46 @@ class Trackers:
         box    = [left, top, right, bottom]
         return box
 
+    def scale_frame(self, frame):
+        if self.scale == 1:
+            return frame
+
+        # The frame is resized once and shared by all trackers
+        if frame is not self.frame:
+            self.frame  = frame
+            self.scaled = cv2.resize(frame, None, fx=self.scale, fy=self.scale,
+                                     interpolation=cv2.INTER_AREA)
+
+        return self.scaled
+
+    def scale_box_down(self, box):
+        return [int(value * self.scale) for value in box]
+
+    def scale_box_up(self, box):
+        return [int(round(value / self.scale)) for value in box]
+
     def convert_rad_to_degree(self, rad):
         factor = math.pi / 180
         return rad / factor
 
-    def add_tracker(self, tracker):
+    def init_tracker(self, tracker, frame, box, label=None):
+        scaled = self.scale_frame(frame)
+        size   = self.convert_box_to_size(self.scale_box_down(box))
+        tracker.init(scaled, size)
+        self.add_tracker(tracker, label)
+
+    def add_tracker(self, tracker, label=None):
         index = self.create_index()
         self.trackers.update({index: tracker})
         self.directions.update({index: None})
         self.previous.update({index: None})
+        self.classes.update({index: label})
 
     def drop_tracker(self, index):
         self.directions.pop(index, None)
         self.previous.pop(index, None)
         self.trackers.pop(index, None)
+        self.classes.pop(index, None)
 
     def save_to_previous(self, index, box):
         self.previous.update({index: box})
@@ -324,6 +573,7 @@ class Trackers:
         self.directions.update({index: angle})
 
     def match(self, updated, detected):
+        geometry     = get_geometry()
         rectangle    = geometry.box(*updated)
         area         = rectangle.area
         intersection = self.get_area_of_intersection(updated, detected)
@@ -333,10 +583,12 @@ class Trackers:
     def update(self, frame, min_magnitude=2):
         updates = {}
         drop    = []
+        scaled  = self.scale_frame(frame)
         
         for index, tracker in self.trackers.items():
-            update    = tracker.update(frame)
+            update    = tracker.update(scaled)
             box       = self.convert_size_to_box(update[1])
+            box       = self.scale_box_up(box) if self.scale != 1 else box
             status    = update[0]
             
             if status is False:
@@ -363,6 +615,9 @@ class Trackers:
 
 class Horizon:
 
+    upward_label   = 'top'
+    downward_label = 'bottom'
+
     def __init__(self, boundary):
         self.boundary = boundary
 
@@ -429,6 +684,9 @@ class Horizon:
 
 class Vertical:
 
+    upward_label   = 'left'
+    downward_label = 'right'
+
     def __init__(self, boundary):
         self.boundary = boundary
 
@@ -457,3 +715,108 @@ class Vertical:
             return True, 'right'
 
         return False, None
+
+# Boundary checkers by the names used in configs
+CHECKERS = {
+    'horizon'  : Horizon,
+    'vertical' : Vertical,
+}
+
+class Counter:
+
+    def __init__(self, transform, boundary_checker, trackers, match_threshold=0.6,
+                 create_tracker=None, names=None):
+
+        '''
+            transform:          Transform used for the detector input.
+
+            boundary_checker:   Horizon or Vertical.
+
+            trackers:           Trackers.
+
+            match_threshold:    Float. Minimum overlap of a detected box
+                                with a tracked one to treat them as the
+                                same object (see Trackers.get_index).
+
+            create_tracker:     Function, which returns a new cv2 tracker.
+                                Default is cv2.TrackerCSRT_create.
+
+            names:              Dict {object id: name} (see load_names).
+                                Keys of per class counts. Without it
+                                counts are keyed by object id.
+        '''
+
+        self.transform        = transform
+        self.boundary_checker = boundary_checker
+        self.trackers         = trackers
+        self.match_threshold  = match_threshold
+        self.create_tracker   = create_tracker or cv2.TrackerCSRT_create
+        self.upward_label     = boundary_checker.upward_label
+        self.downward_label   = boundary_checker.downward_label
+        self.names            = names or {}
+        self.upward           = 0
+        self.downward         = 0
+        self.counts           = {self.upward_label: {}, self.downward_label: {}}
+
+    def add_count(self, line, label):
+        name   = self.names.get(label, label)
+        counts = self.counts[line]
+        counts.update({name: counts.get(name, 0) + 1})
+
+    def detect(self, frame, detected):
+
+        '''
+            Starts trackers for detected objects, which are
+            inside the boundary and are not tracked yet.
+
+            detected:   Output of Detector.__call__.
+        '''
+
+        updates = self.trackers.update(frame)
+
+        for label, box in zip(detected[0], detected[1]):
+            origin = self.transform.convert_to_origin(box)
+
+            if not self.boundary_checker.is_nested(origin):
+                continue
+
+            index = self.trackers.get_index(updates, origin, self.match_threshold)
+
+            if index == None:
+                tracker = self.create_tracker()
+                self.trackers.init_tracker(tracker, frame, origin, label)
+
+    def update(self, frame):
+
+        '''
+            Moves trackers to the frame and counts objects,
+            which crossed the boundary.
+
+            Returns dict {index: box} of objects still tracked.
+        '''
+
+        updates = self.trackers.update(frame)
+        boxes   = {}
+
+        for index, update in updates.items():
+            box       = update[1]
+            direction = self.trackers.directions[index]
+
+            # Direction of a new object is unknown yet
+            if direction != None:
+                status, line = self.boundary_checker.is_crossed(box, direction)
+
+                if status is True:
+                    if line == self.upward_label:
+                        self.upward += 1
+                    elif line == self.downward_label:
+                        self.downward += 1
+
+                    self.add_count(line, self.trackers.classes.get(index))
+
+                    self.trackers.drop_tracker(index)
+                    continue
+
+            boxes.update({index: box})
+
+        return boxes
@@ -0,0 +1,224 @@
+from detection import Transform, Detector, Trackers, Counter, CHECKERS, create_tracker
+from functools import partial
+import itertools
+import json
+import time
+import cv2
+
+
+#===========================#
+#                           #
+#         Functions         #
+#                           #
+#===========================#
+
+def load_clips(path):
+
+    '''
+        path:   JSON file with a list of clips:
+                {"video": "...", "upward": 3, "downward": 5,
+                 "boundary": [350, 50, 970, 670],
+                 "fragment": [300, 0, 1020, 720],
+                 "checker": "horizon"}
+
+                fragment and checker are optional.
+    '''
+
+    with open(path) as file:
+        return json.load(file)
+
+def count_clip(clip, detector, size, drop_n_frames, tracker, threshold=0.6):
+
+    '''
+        Runs the counting loop over one clip.
+        Returns upward, downward, frames, wall time and CPU time.
+    '''
+
+    capture   = cv2.VideoCapture(clip['video'])
+    width     = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height    = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    transform = Transform([width, height], size=size, fragment=clip.get('fragment'))
+    checker   = CHECKERS[clip.get('checker', 'horizon')](clip['boundary'])
+    counter   = Counter(transform, checker, Trackers(),
+                        create_tracker=partial(create_tracker, tracker))
+
+    num_of_frame = 0
+    wall         = 0
+    cpu          = 0
+
+    while capture.isOpened():
+        state, frame = capture.read()
+
+        if state is False:
+            break
+
+        # Decoding the video is the same for every configuration,
+        # so only detection, tracking and counting are timed
+        wall_start = time.perf_counter()
+        cpu_start  = time.process_time()
+
+        if num_of_frame % drop_n_frames == 0:
+            blob     = transform(frame)
+            detected = detector(blob, threshold)
+            counter.detect(frame, detected)
+
+        counter.update(frame)
+
+        wall += time.perf_counter() - wall_start
+        cpu  += time.process_time() - cpu_start
+        num_of_frame += 1
+
+    capture.release()
+    return counter.upward, counter.downward, num_of_frame, wall, cpu
+
+def get_pareto(results):
+
+    '''
+        Marks results, which no other result beats both
+        in error and in frames per second.
+    '''
+
+    for result in results:
+        dominated = False
+
+        for other in results:
+            better = (other['error'] <= result['error'] and other['fps'] >= result['fps'])
+            strict = (other['error'] <  result['error'] or  other['fps'] >  result['fps'])
+
+            if better and strict:
+                dominated = True
+                break
+
+        result.update({'pareto': not dominated})
+
+    return results
+
+def report(results):
+    columns = ['pareto', 'model', 'size', 'drop_n_frames', 'tracker',
+               'error', 'relative', 'fps', 'cpu_ms']
+
+    print(' | '.join(columns))
+
+    for result in sorted(results, key=lambda result: -result['fps']):
+        row = []
+
+        for column in columns:
+            value = result[column]
+
+            if column == 'pareto':
+                value = '*' if value else ''
+            elif isinstance(value, float):
+                value = f'{value:.2f}'
+
+            row.append(str(value))
+
+        print(' | '.join(row))
+
+
+#===========================#
+#                           #
+#         Classes           #
+#                           #
+#===========================#
+
+class Evaluation:
+
+    def __init__(self, clips, models, sizes=(608,), drop_n_frames=(25,),
+                 trackers=('csrt',), threshold=0.6, target=None):
+
+        '''
+            clips:          List of clips, see load_clips.
+
+            models:         Dict {name: (weights, config)}.
+
+            sizes:          Input sizes of the detector.
+
+            drop_n_frames:  Detector intervals.
+
+            trackers:       Names from detection.TRACKERS.
+        '''
+
+        self.clips         = clips
+        self.models        = models
+        self.sizes         = sizes
+        self.drop_n_frames = drop_n_frames
+        self.trackers      = trackers
+        self.threshold     = threshold
+        self.target        = target
+
+    def evaluate(self, detector, size, drop_n_frames, tracker):
+        error  = 0
+        truth  = 0
+        frames = 0
+        wall   = 0
+        cpu    = 0
+
+        for clip in self.clips:
+            counted = count_clip(clip, detector, size, drop_n_frames, tracker, self.threshold)
+            upward, downward, clip_frames, clip_wall, clip_cpu = counted
+
+            error  += abs(upward - clip['upward']) + abs(downward - clip['downward'])
+            truth  += clip['upward'] + clip['downward']
+            frames += clip_frames
+            wall   += clip_wall
+            cpu    += clip_cpu
+
+        return {
+            'error'    : error,
+            'relative' : error / truth if truth > 0 else 0.0,
+            'fps'      : frames / wall if wall > 0 else 0.0,
+            'cpu_ms'   : cpu * 1000 / frames if frames > 0 else 0.0,
+        }
+
+    def __call__(self):
+
+        '''
+            Runs every configuration sequentially, so timings
+            are not disturbed by each other. Returns results
+            with Pareto front marked.
+        '''
+
+        results = []
+
+        for model, (weights, config) in self.models.items():
+            detector = Detector(weights, config, target=self.target)
+
+            matrix = itertools.product(self.sizes, self.drop_n_frames, self.trackers)
+
+            for size, drop_n_frames, tracker in matrix:
+                detector.warmup(size)
+                result = {
+                    'model'         : model,
+                    'size'          : size,
+                    'drop_n_frames' : drop_n_frames,
+                    'tracker'       : tracker,
+                }
+                result.update(self.evaluate(detector, size, drop_n_frames, tracker))
+                results.append(result)
+
+        return get_pareto(results)
+
+
+if __name__ == '__main__':
+
+    #===================#
+    # SETTINGS          #
+    #===================#
+
+    # Файл с размеченными видео (см. load_clips)
+    clips         = load_clips('clips.json')
+
+    models        = {
+        'yolov4'      : ('yolo/yolov4.weights', 'yolo/yolov4.cfg'),
+        'yolov4-tiny' : ('yolo/yolov4-tiny.weights', 'yolo/yolov4-tiny.cfg'),
+    }
+
+    evaluation    = Evaluation(clips, models,
+                               sizes=(320, 416, 608),
+                               drop_n_frames=(5, 15, 25),
+                               trackers=('csrt', 'kcf'),
+                               target=[2, 5, 7])
+
+    # '*' - конфигурации, которые нельзя улучшить по точности,
+    # не потеряв в скорости (фронт Парето)
+    report(evaluation())
@@ -0,0 +1,109 @@
+from collections import deque
+import numpy as np
+import time
+
+
+#===========================#
+#                           #
+#         Classes           #
+#                           #
+#===========================#
+
+class LatencyBudget:
+
+    # Work is shed in this order, one level at a time
+    levels = ('normal', 'skip_render', 'reduce_tracking', 'stretch_detection')
+
+    def __init__(self, budget=None, track_every=2, detect_factor=2, patience=10,
+                 recovery=0.7, window=250):
+
+        '''
+            budget:         Float. Maximum latency (seconds) from capture to
+                            the end of processing. If None, latency is only
+                            measured and no work is shed.
+
+            track_every:    Integer. On 'reduce_tracking' level trackers are
+                            updated once per this number of frames.
+
+            detect_factor:  Integer. On 'stretch_detection' level the
+                            detector interval is multiplied by this factor.
+
+            patience:       Integer. Number of frames in a row over the budget
+                            before the next level. Going back needs five
+                            times more frames under the budget.
+
+            recovery:       Float. Latency below budget * recovery counts
+                            as under the budget.
+
+            window:         Integer. Number of last frames in statistics.
+        '''
+
+        self.budget        = budget
+        self.track_every   = track_every
+        self.detect_factor = detect_factor
+        self.patience      = patience
+        self.recovery      = recovery
+        self.latencies     = deque(maxlen=window)
+        self.level         = 0
+        self.over          = 0
+        self.under         = 0
+
+    @property
+    def render(self):
+        return self.level < 1
+
+    def should_track(self, num_of_frame):
+        if self.level < 2:
+            return True
+
+        return num_of_frame % self.track_every == 0
+
+    def detect_interval(self, drop_n_frames):
+        if self.level < 3:
+            return drop_n_frames
+
+        return drop_n_frames * self.detect_factor
+
+    def observe(self, stamp):
+
+        '''
+            stamp:  time.monotonic() of the frame capture.
+
+            Returns latency of the frame in seconds.
+        '''
+
+        latency = time.monotonic() - stamp
+        self.latencies.append(latency)
+
+        if self.budget is None:
+            return latency
+
+        if latency > self.budget:
+            self.over  += 1
+            self.under  = 0
+        elif latency < self.budget * self.recovery:
+            self.under += 1
+            self.over   = 0
+
+        if self.over >= self.patience and self.level < len(self.levels) - 1:
+            self.level += 1
+            self.over   = 0
+
+        if self.under >= self.patience * 5 and self.level > 0:
+            self.level -= 1
+            self.under  = 0
+
+        return latency
+
+    def stats(self):
+        if not self.latencies:
+            return {'level': self.levels[self.level]}
+
+        latencies = np.array(self.latencies) * 1000
+
+        return {
+            'level' : self.levels[self.level],
+            'last'  : round(float(latencies[-1]), 1),
+            'p50'   : round(float(np.percentile(latencies, 50)), 1),
+            'p95'   : round(float(np.percentile(latencies, 95)), 1),
+        }
@@ -1,208 +1,426 @@
-from detection import Transform, Detector, Trackers, Horizon, Vertical
-from visualization import overlap, rectangle
-import matplotlib.pyplot as plt
-import cv2
+import time
 
+# Время запуска считается с этой строки, поэтому
+# тяжелые модули (cv2, numpy, shapely) импортируются ниже и только там,
+# где они действительно нужны
+started = time.perf_counter()
 
-#===================#
-# TARGET            #
-#===================#
-
-# вводим путь до видео
-video         = ''
+import argparse
+import json
+import os
 
 
 #===================#
-# MODELS            #
+# SETTINGS          #
 #===================#
 
-# yolov4 работает не на всех версиях cv2
-# более легкая, но менее точная модель
-# weights       = 'yolo/yolov4-tiny.weights'
-# config        = 'yolo/yolov4-tiny.cfg'
+# Настройки по умолчанию. Любую из них можно переопределить
+# в конфиге (общие настройки и настройки каждой задачи в 'jobs')
+# или аргументами командной строки.
+#
+# Пример конфига:
+# {
+#     "weights": "yolo/yolov4-tiny.weights",
+#     "config":  "yolo/yolov4-tiny.cfg",
+#     "jobs": [
+#         {"video": "first.mp4",  "output": null},
+#         {"video": "second.mp4", "boundary": [300, 50, 900, 670], "checker": "vertical"}
+#     ]
+# }
+#
+# Все задачи выполняются в одном процессе и используют одну загруженную сеть.
+
+DEFAULTS = {
+
+    # вводим путь до видео
+    'video'           : '',
+
+    # yolov4 работает не на всех версиях cv2
+    # yolo/yolov4-tiny.* - более легкая, но менее точная модель
+    'weights'         : 'yolo/yolov4.weights',
+    'config'          : 'yolo/yolov4.cfg',
+
+    # Бэкенд и устройство для cv2.dnn: 'opencv' + 'cpu' работает везде.
+    # precision = 'fp16' используется, только если версия cv2 его поддерживает
+    'backend'         : 'opencv',
+    'device'          : 'cpu',
+    'precision'       : 'fp32',
+
+    # Размер входа сети: 320, 416, 512 или 608.
+    # Меньше - быстрее, но хуже находятся маленькие объекты
+    'input_size'      : 608,
+
+    # Если True, перед запуском печатается время одного прохода
+    # сети (мс) для каждого размера входа
+    'benchmark'       : False,
+
+    # Число процессов для сети (DetectorPool). 0 - сеть работает
+    # в этом процессе. Каждый процесс загружает сеть один раз,
+    # кадры передаются через общую память. Задачи выполняются по
+    # очереди, поэтому здесь в работе всегда один кадр и он получает
+    # все ядра. Выигрыш пул дает, когда его делят несколько потоков
+    # (Stream в Microserver.py).
+    'workers'         : 0,
+
+    # Тут определяем объекты, которые хотим детектировать
+    # Нужно задать номера из файла yolo/coco.json
+    # Например: 2 = легковые автомобили, 5 = автобусы, 7 = грузовики
+    'target'          : [2, 5, 7],
+
+    # Это один из самых выжных параметров. Он отвечает за частоту
+    # использования детектора. Например, если стоит число 25, то
+    # детектор срабатывает раз в 25 кадров. В остальное время работают
+    # только трекеры.
+    'drop_n_frames'   : 25,
+
+    # Порог уверенности детектора и порог NMS
+    'threshold'       : 0.6,
+    'nms_threshold'   : 0.4,
+
+    # Свои пороги для отдельных объектов, например {"5": 0.7, "7": 0.7}.
+    # Остальные объекты используют threshold
+    'thresholds'      : {},
+
+    # Названия объектов для счетчиков по классам
+    'names'           : 'yolo/coco.json',
+
+    # Минимальная доля пересечения рамки трекера с новой детекцией,
+    # при которой считаем, что это тот же объект
+    'match_threshold' : 0.6,
+
+    # Масштаб кадра для трекеров. CSRT работает тем медленнее, чем
+    # больше объект, поэтому трекерам можно отдавать уменьшенный кадр.
+    # Например, 0.5 ускоряет трекинг в несколько раз ценой точности рамок.
+    # Координаты рамок пересчитываются в исходное разрешение автоматически.
+    'tracking_scale'  : 1.0,
+
+    # В разных случаях можно ипользовать разные виды трекеров:
+    # csrt, kcf, mosse, medianflow
+    # Если выдает ошибку, сторит установить расширенную версию cv2
+    'tracker'         : 'csrt',
+
+    # Папка для кэша детекций, например 'cache' (или --cache cache).
+    # Если видео уже обрабатывалось с теми же настройками модели,
+    # детекции читаются с диска, а сеть не запускается, иначе
+    # записываются туда. Так можно быстро перепроверить boundary,
+    # checker и т.д. None - не использовать кэш.
+    'cache_dir'       : None,
+
+    # Детекции сохраняются до NMS с этим порогом, поэтому при повторных
+    # запусках можно менять threshold (но не ниже cache_threshold)
+    'cache_threshold' : 0.3,
+
+    # Детектор работает только с квадратными изображениями,
+    # Поэтому тут мы указываем часть изображения, за которой будем следить
+    'fragment'        : [300, 0, 1020, 720],
+
+    # Указываем размер исходных изображений (разрешение камеры)
+    'input_shape'     : [1280, 720],
+
+    # Прямоугольная граница, за пересечением которой, мы следим
+    'boundary'        : [350, 50, 970, 670],
+
+    # Для вертикального детектирования: 'vertical'
+    'checker'         : 'horizon',
+
+    # Видео с обнаруженными объектами. None - без отрисовки (быстрее)
+    'output'          : 'mall.mp4',
+    'frame_rate'      : 25.0,
+
+    # Печатать счетчики на каждом кадре
+    'verbose'         : True,
+}
+
+# Настройки, от которых зависит загруженная сеть
+MODEL = ('weights', 'config', 'target', 'backend', 'device', 'precision', 'thresholds')
 
-weights       = 'yolo/yolov4.weights'
-config        = 'yolo/yolov4.cfg'
 
-# Тут определяем объекты, которые хотим детектировать
-# Нужно задать номера из файла yolo/coco.json
-# Например: 2 = легковые автомобили, 5 = автобусы, 7 = грузовики
-target        = [2, 5, 7]
+#===================#
+# CONFIGURATION     #
+#===================#
 
-# Это один из самых выжных параметров. Он отвечает за частоту
-# использования детектора. Например, если стоит число 25, то
-# детектор срабатывает раз в 25 кадров. В остальное время работают
-# только трекеры.
-drop_n_frames = 25
+def parse_args():
+    parser = argparse.ArgumentParser(description='Car tracking and counting')
+    parser.add_argument('config_file', nargs='?', help='JSON config with settings and jobs')
+    parser.add_argument('--video',     help='path to video')
+    parser.add_argument('--output',    help='path to output video')
+    parser.add_argument('--no-output', action='store_true', help='do not render output video')
+    parser.add_argument('--cache',     metavar='DIR', help='record and replay detections in DIR')
+    parser.add_argument('--benchmark', action='store_true', help='print ms per forward pass')
+    parser.add_argument('--workers',   type=int, help='number of detector processes')
+    parser.add_argument('--quiet',     action='store_true', help='print only results')
+    return parser.parse_args()
+
+def load_jobs(args):
+    settings = dict(DEFAULTS)
+    jobs     = [{}]
+
+    if args.config_file is not None:
+        with open(args.config_file) as file:
+            loaded = json.load(file)
+
+        jobs = loaded.pop('jobs', None) or [{}]
+        settings.update(loaded)
+
+    overrides = {}
+
+    if args.video is not None:
+        overrides.update({'video': args.video})
+    if args.output is not None:
+        overrides.update({'output': args.output})
+    if args.no_output:
+        overrides.update({'output': None})
+    if args.cache is not None:
+        overrides.update({'cache_dir': args.cache})
+    if args.benchmark:
+        overrides.update({'benchmark': True})
+    if args.workers is not None:
+        overrides.update({'workers': args.workers})
+    if args.quiet:
+        overrides.update({'verbose': False})
+
+    jobs = [{**settings, **job, **overrides} for job in jobs]
+
+    # Размер проверяем до загрузки сети: другие размеры
+    # падают только внутри net.forward
+    from detection import PROFILES
+
+    # В JSON ключи - строки, а детектору нужны номера объектов
+    for job in jobs:
+        job['thresholds'] = {int(index): value for index, value in job['thresholds'].items()}
+
+        assert job['input_size'] in PROFILES, f'input_size must be one of {PROFILES}.'
+
+    return jobs
 
 
 #===================#
 # INITIALIZATION    #
 #===================#
 
-detector      = Detector(weights, config, target=target)
-capture       = cv2.VideoCapture(video)
+# Загруженные детекторы. Задачи с одинаковой моделью используют один
+detectors = {}
 
-# Детектор работает только с квадратными изображениями,
-# Поэтому тут мы указываем часть изображения, за которой будем следить
-fragment      = [300, 0, 1020, 720]
+def create_pool(job):
+    from workers import DetectorPool
 
-# Указываем размер исходных изображений (разрешение камеры)
-input_shape   = [1280, 720]
-transform     = Transform(input_shape, fragment=fragment)
+    return DetectorPool(job['weights'], job['config'], size=job['input_size'],
+                        workers=job['workers'], target=job['target'],
+                        backend=job['backend'], device=job['device'],
+                        precision=job['precision'], thresholds=job['thresholds'])
 
+def get_detector(job):
+    from detection import Detector
 
-#===================#
-# TEXT              #
-#===================#
+    key = tuple(json.dumps(job[name]) for name in MODEL)
 
-# Только для отрисовки
-bottom_org    = (50, 620)
-top_org       = (50, 520)
-font          = cv2.FONT_HERSHEY_SIMPLEX 
-fontScale     = 1
-fontColor     = (255, 255, 255)
-thickness     = 2
+    # Размер входа пула задается при создании
+    if job['workers'] > 0:
+        key += (job['input_size'], job['workers'])
 
+    if key not in detectors:
+        if job['workers'] > 0:
+            detector = create_pool(job)
+        else:
+            detector = Detector(job['weights'], job['config'], target=job['target'],
+                                backend=job['backend'], device=job['device'],
+                                precision=job['precision'], thresholds=job['thresholds'])
 
-#===================#
-# BOUNDARY          #
-#===================#
+            if job['benchmark']:
+                print(f'detector: {detector.describe()}')
+
+                for size, ms in detector.benchmark().items():
+                    print(f'{size}: {ms:.1f} ms')
 
-# Прямоугольная граница, за пересечением которой, мы следим
-boundary      = [350, 50, 970, 670]
+        detectors.update({key: detector})
 
-# Для вертикального детектирования нужно заменить Horizon на Vertical
-boundary_checker = Horizon(boundary)
+    # Первый проход сети долгий (ленивая инициализация слоев),
+    # поэтому делаем его до начала обработки видео
+    detector = detectors[key]
+    detector.warmup(job['input_size'])
+    return detector
 
-if isinstance(boundary_checker, Horizon):
-    upward_label   = 'top'
-    downward_label = 'bottom'
-else:
-    upward_label   = 'left'
-    downward_label = 'right'
+def create_cache(job, record=False):
+    from cache import DetectionCache
+
+    return DetectionCache(job['cache_dir'], job['video'], threshold=job['cache_threshold'],
+                          record=record,
+                          weights=job['weights'], config=job['config'],
+                          size=job['input_size'], fragment=job['fragment'],
+                          shape=job['input_shape'], target=job['target'],
+                          backend=job['backend'], device=job['device'],
+                          precision=job['precision'])
 
 
 #===================#
-# TRACKERS          #
+# COUNTING          #
 #===================#
 
-trackers      = Trackers()
-num_of_frame  = 0
-upward        = 0
-downward      = 0
+def run_job(job, started):
+    from detection import Transform, Trackers, Counter, CHECKERS
+    from detection import create_tracker, load_names
+    from functools import partial
+    import cv2
+
+    # Потоки (rtsp://, http://) открывает cv2, файлы проверяем сами,
+    # иначе cv2 молча вернет пустое видео
+    stream = '://' in job['video']
+
+    if not stream and not os.path.isfile(job['video']):
+        print(f'Video not found: {job["video"]}')
+        return None
+
+    capture   = cv2.VideoCapture(job['video'])
+    cache     = None
+    out       = None
+
+    # Кэш, видео и захват закрываются и при ошибке: иначе кадры,
+    # записанные после последнего сброса индекса, будут потеряны
+    try:
+        transform = Transform(job['input_shape'], size=job['input_size'], fragment=job['fragment'])
+
+        # Ключ кэша строится по размеру и времени изменения файла,
+        # поэтому поток не кэшируется
+        if job['cache_dir'] is not None and not stream:
+            cache  = create_cache(job)
+            frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            replay = cache.covers(range(0, frames, job['drop_n_frames']))
+
+            # Файлы кэша меняются, только если есть что дописать
+            if not replay:
+                cache = create_cache(job, record=True)
+        else:
+            cache  = None
+            replay = False
+
+        # Сеть загружается, только если в кэше есть не все нужные кадры
+        detector = None if replay else get_detector(job)
+
+        boundary_checker = CHECKERS[job['checker']](job['boundary'])
+        trackers         = Trackers(scale=job['tracking_scale'])
+        counter          = Counter(transform, boundary_checker, trackers,
+                                   match_threshold=job['match_threshold'],
+                                   create_tracker=partial(create_tracker, job['tracker']),
+                                   names=load_names(job['names']))
+        upward_label     = boundary_checker.upward_label
+        downward_label   = boundary_checker.downward_label
+        threshold        = job['threshold']
+        nms_threshold    = job['nms_threshold']
+        thresholds       = job['thresholds']
+
+        # Формат и разрешение полученного видео
+        if job['output'] is not None:
+            from visualization import draw
+
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            shape  = tuple(job['input_shape'])
+            out    = cv2.VideoWriter(job['output'], fourcc, job['frame_rate'], shape)
+        else:
+            out    = None
+
+        # Время от запуска (или начала задачи) до первого кадра
+        print(f'startup: {time.perf_counter() - started:.2f} s')
+
+        num_of_frame = 0
+
+        # Подсчет трафика и создане видео с обнаруженными объектами
+        while capture.isOpened():
+
+            state, frame = capture.read()
+
+            if state is False:
+                break
+
+            # Этап обнаружения и добавления в трекеров
+            # т.к детектор тяжелый, производим проверку
+            # один раз на каждые 'drop_n_frames' кадров.
+            # В остальное время всю работу выполняет трекер
+            if num_of_frame % job['drop_n_frames'] == 0:
+
+                if cache is not None and num_of_frame in cache:
+                    detected = cache(num_of_frame, threshold, nms_threshold, thresholds)
+                else:
+                    if detector is None:
+                        detector = get_detector(job)
+
+                    blob = transform(frame)
+
+                    if cache is not None:
+                        decoded  = detector.decode(blob, job['cache_threshold'])
+                        cache.write(num_of_frame, decoded)
+                        detected = cache.replay(decoded, threshold, nms_threshold, thresholds)
+                    else:
+                        detected = detector(blob, threshold, nms_threshold)
+
+                # Новые объекты внутри границы получают свои трекеры
+                counter.detect(frame, detected)
+
+            # Передаем трекерам новый кадр (обновляем положения объектов)
+            # и считаем объекты, пересекшие границу
+            boxes    = counter.update(frame)
+            upward   = counter.upward
+            downward = counter.downward
+
+            # Отрисовывает границу, рамки и счетчики на видео
+            if out is not None:
+                lines = [f'{upward_label}:   {upward}', f'{downward_label}: {downward}']
+                over  = draw(frame, job['boundary'], boxes.values(), lines)
+                out.write(over)
+
+            if job['verbose']:
+                print('=======================')
+                print(f'{upward_label}:    {upward}')
+                print(f'{downward_label}:  {downward}')
+                print('')
+
+            num_of_frame += 1
+
+        # Результаты по видео
+        print(f'Сводка по видео {job["video"]}')
+        print(f'{upward_label}: {counter.upward}')
+        print(f'{downward_label}: {counter.downward}')
+
+        # Результаты по классам объектов
+        for line, counts in counter.counts.items():
+            for name, count in counts.items():
+                print(f'{line} {name}: {count}')
+
+        return counter.upward, counter.downward
+    finally:
+
+        # Сохраняем видео
+        if out is not None:
+            out.release()
+
+        if cache is not None:
+            cache.close()
+
+        capture.release()
+
+def main():
+    args = parse_args()
+    jobs = load_jobs(args)
+
+    failed = 0
 
+    try:
+        for i, job in enumerate(jobs):
+
+            # Ошибка в одной задаче не должна останавливать остальные
+            try:
+                run_job(job, started if i == 0 else time.perf_counter())
+            except Exception as error:
+                failed += 1
+                print(f'Job {i} ({job["video"]}) failed: {type(error).__name__}: {error}')
+    finally:
+
+        # Процессы пулов нужно остановить, а общую память освободить
+        for detector in detectors.values():
+            if hasattr(detector, 'close'):
+                detector.close()
+
+    return 1 if failed else 0
 
-#===================#
-# OUTPUT VIDEO      #
-#===================#
 
-# Формат и разрешение полученного видео
-fourcc        = cv2.VideoWriter_fourcc(*'mp4v')
-frame_rate    = 25.0
-shape         = (1280, 720)
-out           = cv2.VideoWriter('mall.mp4', fourcc, frame_rate, shape)
-
-
-# Подсчет трафика и создане видео с обнаруженными объектами
-
-while capture.isOpened():
-    
-    state, frame = capture.read()
-    
-    if state is False:
-        break
-    
-    # Этап обнаружения и добавления в трекеров
-    # т.к детектор тяжелый, производим проверку
-    # один раз на каждые 'drop_n_frames' кадров.
-    # В остальное время всю работу выполняет трекер
-    if num_of_frame % drop_n_frames == 0:
-        blob     = transform(frame)
-        detected = detector(blob, threshold=0.6)
-        update   = trackers.update(frame)
-    
-        for box in detected[1]:
-            origin = transform.convert_to_origin(box)
-            nested = boundary_checker.is_nested(origin)
-            
-            # Проверяем, находится ли объект в детектируемой области
-            if not nested:
-                continue
-            
-            # Проверяем, ведет ли какой-то трекер этот объект
-            index = trackers.get_index(update, origin)
-        
-            if index == None:
-                size    = trackers.convert_box_to_size(origin)
-                
-                # В разных случаях можно ипользовать разные виды трекеров
-                # Если выдает ошибку, сторит установить расширенную версию cv2
-                tracker = cv2.TrackerCSRT_create()
-                tracker.init(frame, size)
-                trackers.add_tracker(tracker)
-    
-    # Передаем трекерам новый кадр (обновляем положения объектов)
-    updates   = trackers.update(frame)
-    
-    # Отрисовывает рамки на видео
-    over = overlap(frame, [0, 0, 1280, 50], white=False)
-    over = overlap(over, [0, 50, 350, 670], white=False)
-    over = overlap(over, [0, 670, 1280, 720], white=False)
-    over = overlap(over, [970, 50, 1280, 670], white=False)
-
-    for index, update in updates.items():
-        status    = update[0]
-        box       = update[1]
-        direction = trackers.directions[index]
-        
-        # По одному кадру трудно определить направлени,
-        # Поэтому для новых объектов direction = None
-        if direction != None:
-            
-            # Проверка пересечения граничных линий
-            cross  = boundary_checker.is_crossed(box, direction)
-            status = cross[0]
-            line   = cross[1]
-            
-            # Если пересек, изменяем счетчики
-            if status is True:
-                
-                # Какую линию мы пересекли?
-                # Для Vertical: left и right
-                if line == upward_label:
-                    upward += 1
-                elif line == downward_label:
-                    downward += 1
-                
-                # закрываем трекер
-                trackers.drop_tracker(index)
-                continue
-        
-        # Отрисовка границ объекта
-        left, top, right, bottom = box
-        over = cv2.rectangle(over, (left, top), (right, bottom), (8, 67, 226), 2)
-    
-    
-    upward_text =   f'{upward_label}:   {upward}'
-    over = cv2.putText(over, upward_text, top_org, font, fontScale, fontColor, thickness, cv2.LINE_AA)
-    
-    downward_text = f'{downward_label}: {downward}'
-    over = cv2.putText(over, downward_text, bottom_org, font, fontScale, fontColor, thickness, cv2.LINE_AA)
-    
-    out.write(over)
-    
-    print('=======================')
-    print(f'{upward_label}:    {upward}')
-    print(f'{downward_label}:  {downward}')
-    print('')
-    
-    num_of_frame += 1
-
-# Результаты по видео
-print('Сводка по видео')
-print(f'{upward_label}: {upward}')
-print(f'{downward_label}: {downward}')
-
-# Сохраняем видео
-out.release()
\ No newline at end of file
+if __name__ == '__main__':
+    raise SystemExit(main())
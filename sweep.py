@@ -0,0 +1,238 @@
+from detection import Transform, Trackers, Counter, CHECKERS
+from cache import DetectionCache
+import multiprocessing
+import itertools
+import time
+import os
+import cv2
+
+
+#===========================#
+#                           #
+#         Constants         #
+#                           #
+#===========================#
+
+DEFAULTS = {
+    'drop_n_frames'   : 25,
+    'threshold'       : 0.6,
+    'nms_threshold'   : 0.4,
+    'thresholds'      : {},
+    'match_threshold' : 0.6,
+    'boundary'        : [350, 50, 970, 670],
+    'checker'         : 'horizon',
+}
+
+
+#===========================#
+#                           #
+#         Functions         #
+#                           #
+#===========================#
+
+def create_configurations(grid):
+
+    '''
+        grid:   Dict {parameter: list of values}.
+                Missing parameters take values from DEFAULTS.
+
+        Returns list of dicts, one for every combination.
+    '''
+
+    grid   = {**{key: [value] for key, value in DEFAULTS.items()}, **grid}
+    keys   = list(grid.keys())
+    values = itertools.product(*[grid[key] for key in keys])
+    return [dict(zip(keys, combination)) for combination in values]
+
+def get_error(result, truth):
+    if truth is None:
+        return None
+
+    upward   = abs(result['upward'] - truth['upward'])
+    downward = abs(result['downward'] - truth['downward'])
+    return upward + downward
+
+def evaluate(task):
+
+    '''
+        Runs the counting loop over the video with detections
+        replayed from the cache. Returns the configuration
+        with counts, fps and error.
+    '''
+
+    video, cache, transform, tracking_scale, configuration, truth = task
+
+    drop_n_frames    = configuration['drop_n_frames']
+    threshold        = configuration['threshold']
+    nms_threshold    = configuration['nms_threshold']
+    thresholds       = configuration['thresholds']
+    boundary_checker = CHECKERS[configuration['checker']](configuration['boundary'])
+    trackers         = Trackers(scale=tracking_scale)
+    counter          = Counter(transform, boundary_checker, trackers,
+                               match_threshold=configuration['match_threshold'])
+
+    # Every process decodes the video itself, cv2 captures can't be shared
+    cv2.setNumThreads(1)
+    capture          = cv2.VideoCapture(video)
+    num_of_frame     = 0
+    start            = time.perf_counter()
+
+    while capture.isOpened():
+        state, frame = capture.read()
+
+        if state is False:
+            break
+
+        if num_of_frame % drop_n_frames == 0:
+            detected = cache(num_of_frame, threshold, nms_threshold, thresholds)
+            counter.detect(frame, detected)
+
+        counter.update(frame)
+        num_of_frame += 1
+
+    elapsed = time.perf_counter() - start
+    capture.release()
+
+    result  = dict(configuration)
+    result.update({
+        'upward'   : counter.upward,
+        'downward' : counter.downward,
+        'frames'   : num_of_frame,
+        'fps'      : num_of_frame / elapsed if elapsed > 0 else 0,
+    })
+    result.update({'error': get_error(result, truth)})
+    return result
+
+def report(results):
+    columns = ['drop_n_frames', 'threshold', 'thresholds', 'nms_threshold', 'match_threshold',
+               'checker', 'boundary', 'upward', 'downward', 'error', 'fps']
+
+    print(' | '.join(columns))
+
+    for result in results:
+        row = []
+
+        for column in columns:
+            value = result[column]
+            value = f'{value:.1f}' if column == 'fps' else str(value)
+            row.append(value)
+
+        print(' | '.join(row))
+
+
+#===========================#
+#                           #
+#         Classes           #
+#                           #
+#===========================#
+
+class Sweep:
+
+    def __init__(self, video, cache, transform, tracking_scale=1.0, processes=None):
+
+        '''
+            video:          Path to video.
+
+            cache:          DetectionCache filled by run.py for this video
+                            with every frame needed by the grid.
+
+            transform:      Transform used when the cache was recorded.
+
+            tracking_scale: Float. See Trackers.
+
+            processes:      Number of processes. Default is the CPU count.
+        '''
+
+        self.video          = video
+        self.cache          = cache
+        self.transform      = transform
+        self.tracking_scale = tracking_scale
+        self.processes      = processes or os.cpu_count() or 1
+
+    def check(self, configurations):
+        capture = cv2.VideoCapture(self.video)
+        frames  = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+
+        for configuration in configurations:
+            drop_n_frames = configuration['drop_n_frames']
+            threshold     = min([configuration['threshold'], *configuration['thresholds'].values()])
+
+            if threshold < self.cache.threshold:
+                raise ValueError(f'Threshold {threshold} is lower than the cached {self.cache.threshold}.')
+
+            if not self.cache.covers(range(0, frames, drop_n_frames)):
+                raise ValueError(f'Cache has no detections for drop_n_frames = {drop_n_frames}.')
+
+    def __call__(self, grid, truth=None):
+
+        '''
+            grid:   Dict {parameter: list of values}. Parameters are
+                    drop_n_frames, threshold, nms_threshold, thresholds
+                    (per object id), match_threshold, boundary and checker.
+
+            truth:  Optional dict {'upward': int, 'downward': int}.
+
+            Returns list of results sorted by error (if truth
+            is given) and fps.
+        '''
+
+        configurations = create_configurations(grid)
+        self.check(configurations)
+
+        tasks = []
+
+        for configuration in configurations:
+            task = (self.video, self.cache, self.transform,
+                    self.tracking_scale, configuration, truth)
+            tasks.append(task)
+
+        with multiprocessing.Pool(self.processes) as pool:
+            results = list(pool.imap_unordered(evaluate, tasks))
+
+        key = lambda result: (result['error'] or 0, -result['fps'])
+        return sorted(results, key=key)
+
+
+if __name__ == '__main__':
+
+    #===================#
+    # SETTINGS          #
+    #===================#
+
+    # Настройки видео, модели и кэша должны совпадать с run.py,
+    # иначе кэш не будет найден. Сначала нужно один раз запустить
+    # run.py --cache cache с таким drop_n_frames, на который делятся все
+    # значения из сетки. Здесь кэш только читается.
+    video           = ''
+    weights         = 'yolo/yolov4.weights'
+    config          = 'yolo/yolov4.cfg'
+    backend         = 'opencv'
+    device          = 'cpu'
+    precision       = 'fp32'
+    input_size      = 608
+    target          = [2, 5, 7]
+    fragment        = [300, 0, 1020, 720]
+    input_shape     = [1280, 720]
+    cache_dir       = 'cache'
+    cache_threshold = 0.3
+    tracking_scale  = 1.0
+
+    # Сетка параметров. Не указанные параметры берутся из DEFAULTS
+    grid = {
+        'drop_n_frames'   : [5, 10, 25],
+        'threshold'       : [0.4, 0.5, 0.6],
+        'match_threshold' : [0.4, 0.6],
+    }
+
+    # Реальные значения счетчиков (если известны)
+    truth           = None
+
+    transform       = Transform(input_shape, size=input_size, fragment=fragment)
+    cache           = DetectionCache(cache_dir, video, threshold=cache_threshold,
+                                     weights=weights, config=config, size=input_size,
+                                     fragment=fragment, shape=input_shape, target=target,
+                                     backend=backend, device=device, precision=precision)
+    sweep           = Sweep(video, cache, transform, tracking_scale=tracking_scale)
+    results         = sweep(grid, truth=truth)
+    report(results)
@@ -0,0 +1,113 @@
+from cache import DetectionCache
+import pickle
+import pytest
+import os
+
+
+DETECTIONS = ([2, 7], [[10, 20, 30, 40], [50, 60, 70, 80]], [0.9, 0.5])
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'frames')
+    return str(path)
+
+def open_cache(tmp_path, video, record=True):
+    return DetectionCache(str(tmp_path / 'cache'), video, threshold=0.3, record=record, size=608)
+
+def test_round_trip(tmp_path, video):
+    with open_cache(tmp_path, video) as cache:
+        cache.write(0, DETECTIONS)
+        indices, sizes, confs = cache.read(0)
+
+    assert indices == [2, 7]
+    assert sizes == [[10, 20, 30, 40], [50, 60, 70, 80]]
+    assert confs == pytest.approx([0.9, 0.5])
+
+def test_reopen(tmp_path, video):
+    with open_cache(tmp_path, video) as cache:
+        cache.write(0, DETECTIONS)
+        cache.write(5, DETECTIONS)
+
+    cache = open_cache(tmp_path, video, record=False)
+
+    assert 0 in cache and 5 in cache
+    assert 1 not in cache
+    assert cache.covers(range(0, 10, 5))
+    assert cache.read(5)[0] == [2, 7]
+
+    with pytest.raises(KeyError):
+        cache.read(1)
+
+def test_pickle(tmp_path, video):
+    cache = open_cache(tmp_path, video)
+    cache.write(0, DETECTIONS)
+    copy  = pickle.loads(pickle.dumps(cache))
+
+    assert copy.read(0) == cache.read(0)
+    cache.close()
+
+def test_empty_frame(tmp_path, video):
+    with open_cache(tmp_path, video) as cache:
+        cache.write(0, ([], [], []))
+        assert cache.read(0) == ([], [], [])
+
+    cache = open_cache(tmp_path, video, record=False)
+    assert cache.read(0) == ([], [], [])
+
+def test_unindexed_rows_are_dropped(tmp_path, video):
+    with open_cache(tmp_path, video) as cache:
+        cache.write(0, DETECTIONS)
+
+    # An interrupted run: rows and a partial row, but no index
+    cache = open_cache(tmp_path, video)
+    cache.write(5, DETECTIONS)
+    cache.writer.write(b'\0' * 5)
+    cache.writer.close()
+    cache.lock.close()
+
+    cache = open_cache(tmp_path, video)
+    cache.write(10, DETECTIONS)
+    cache.close()
+
+    assert 5 not in cache
+    assert os.path.getsize(cache.records_path) == 4 * DetectionCache.columns * 4
+    assert cache.read(10) == cache.read(0)
+
+def test_replay_does_not_change_files(tmp_path, video):
+    writer = open_cache(tmp_path, video)
+    writer.write(0, DETECTIONS)
+    writer.flush()
+
+    for frame in range(1, 5):
+        writer.write(frame, DETECTIONS)
+
+    # Opened while frames 1-4 are written but not indexed yet
+    reader = open_cache(tmp_path, video, record=False)
+    assert 0 in reader and 1 not in reader
+
+    with pytest.raises(AssertionError):
+        reader.write(1, DETECTIONS)
+
+    writer.write(5, ([7], [[1, 2, 3, 4]], [0.8]))
+    writer.close()
+
+    cache = open_cache(tmp_path, video, record=False)
+
+    for frame in range(5):
+        assert cache.read(frame)[0] == [2, 7]
+
+    assert cache.read(5)[0] == [7]
+
+def test_one_recorder_at_a_time(tmp_path, video):
+    with open_cache(tmp_path, video):
+        with pytest.raises(RuntimeError):
+            open_cache(tmp_path, video)
+
+    open_cache(tmp_path, video).close()
+
+def test_replay_of_missing_cache(tmp_path, video):
+    cache = open_cache(tmp_path, video, record=False)
+
+    assert not cache.covers(range(0, 10, 5))
+    assert not os.path.exists(tmp_path / 'cache')
@@ -0,0 +1,136 @@
+from detection import Detector, Transform, Trackers, Counter, Horizon, load_names
+from cache import DetectionCache
+import numpy as np
+import threading
+import pytest
+import os
+
+
+SIZE  = 320
+NAMES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'yolo', 'coco.json')
+
+def row(index, conf, center_x, center_y, width, height):
+    detection = np.zeros(85, dtype=np.float32)
+    detection[:5]        = (center_x, center_y, width, height, conf)
+    detection[5 + index] = conf
+    return detection
+
+# Output of one yolo layer: [N, 85]
+OUTPUT = np.stack([
+    row(2, 0.90, 0.25, 0.25, 0.1, 0.1),
+    row(5, 0.65, 0.50, 0.50, 0.2, 0.2),
+    row(7, 0.45, 0.75, 0.75, 0.1, 0.1),
+    row(0, 0.95, 0.50, 0.25, 0.1, 0.1),
+    row(2, 0.35, 0.75, 0.25, 0.1, 0.1),
+    row(2, 0.85, 0.26, 0.25, 0.1, 0.1),
+])
+
+class Net:
+
+    def setInput(self, blob):
+        pass
+
+    def forward(self, layers):
+        return [OUTPUT]
+
+class Tracker:
+
+    # Moves the box up and to the right on every update
+    def init(self, frame, size):
+        self.size = list(size)
+
+    def update(self, frame):
+        self.size[0] += 5
+        self.size[1] -= 20
+        return True, tuple(self.size)
+
+@pytest.fixture
+def detector(monkeypatch):
+    monkeypatch.setattr(Detector, 'load_network', lambda self, weights, config: (Net(), threading.Lock()))
+    monkeypatch.setattr(Detector, 'getOutputsNames', lambda self, net: [])
+
+    def create(**options):
+        return Detector('yolo.weights', 'yolo.cfg', **options)
+
+    return create
+
+def blob():
+    return np.zeros((1, 3, SIZE, SIZE), dtype=np.float32)
+
+def test_decode_threshold(detector):
+    indices, sizes, confs = detector().decode(blob(), 0.6)
+
+    assert indices == [2, 5, 0, 2]
+    assert all(type(index) is int for index in indices)
+    assert sizes[0] == [64, 64, 32, 32]
+    assert confs == pytest.approx([0.90, 0.65, 0.95, 0.85])
+
+def test_decode_target(detector):
+    indices, sizes, confs = detector(target=[2, 5, 7]).decode(blob(), 0.6)
+
+    assert indices == [2, 5, 2]
+
+def test_decode_thresholds(detector):
+
+    # Keys from JSON configs are strings
+    detector = detector(target=[2, 5, 7], thresholds={'7': 0.4, '5': 0.7})
+    assert detector.thresholds == {7: 0.4, 5: 0.7}
+
+    indices, sizes, confs = detector.decode(blob(), 0.6, detector.thresholds)
+    assert indices == [2, 7, 2]
+
+def test_get_thresholds(detector):
+    classes = np.array([2, 5, 7, 2])
+    limits  = detector().get_thresholds(classes, 0.6, {7: 0.4, 2: 0.8})
+
+    assert limits.tolist() == pytest.approx([0.8, 0.6, 0.4, 0.8])
+
+def test_call_applies_nms(detector):
+    indices, boxes, confs = detector(target=[2, 5, 7])(blob(), 0.6, 0.4)
+
+    # The second car overlaps the first one
+    assert indices == [2, 5]
+    assert boxes[0] == [64, 64, 96, 96]
+
+@pytest.mark.parametrize('thresholds', [{}, {7: 0.4}, {5: 0.7, 2: 0.3}])
+def test_replay_matches_call(detector, tmp_path, thresholds):
+    detector = detector(target=[2, 5, 7], thresholds=thresholds)
+    video    = tmp_path / 'video.mp4'
+    video.write_bytes(b'frames')
+
+    with DetectionCache(str(tmp_path / 'cache'), str(video), threshold=0.3, record=True) as cache:
+        cache.write(0, detector.decode(blob(), 0.3))
+        replayed = cache(0, 0.6, 0.4, thresholds)
+
+    indices, boxes, confs = detector(blob(), 0.6, 0.4)
+
+    assert replayed[0] == indices
+    assert replayed[1] == boxes
+    assert replayed[2] == pytest.approx(confs)
+
+def test_counts_by_names():
+    transform = Transform([SIZE, SIZE], size=SIZE)
+    counter   = Counter(transform, Horizon([20, 100, 300, 300]), Trackers(),
+                        create_tracker=Tracker, names=load_names(NAMES))
+    frame     = np.zeros((SIZE, SIZE, 3), dtype=np.uint8)
+
+    counter.detect(frame, ([2, 7], [[40, 200, 80, 240], [200, 200, 240, 240]], [0.9, 0.8]))
+
+    for _ in range(6):
+        counter.update(frame)
+
+    assert counter.upward == 2
+    assert counter.counts == {'top': {'car': 1, 'truck': 1}, 'bottom': {}}
+
+def test_counts_without_names():
+    transform = Transform([SIZE, SIZE], size=SIZE)
+    counter   = Counter(transform, Horizon([20, 100, 300, 300]), Trackers(),
+                        create_tracker=Tracker)
+    frame     = np.zeros((SIZE, SIZE, 3), dtype=np.uint8)
+
+    counter.detect(frame, ([2], [[40, 200, 80, 240]], [0.9]))
+
+    for _ in range(6):
+        counter.update(frame)
+
+    assert counter.counts == {'top': {2: 1}, 'bottom': {}}
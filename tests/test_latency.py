@@ -0,0 +1,81 @@
+from latency import LatencyBudget
+import time
+
+
+def observe(budget, latency, frames):
+    for _ in range(frames):
+        budget.observe(time.monotonic() - latency)
+
+def test_no_budget_never_sheds():
+    budget = LatencyBudget(None, patience=2)
+    observe(budget, 10, 20)
+
+    assert budget.level == 0
+    assert budget.stats()['level'] == 'normal'
+
+def test_levels_go_up_one_at_a_time():
+    budget = LatencyBudget(0.1, patience=3)
+
+    observe(budget, 1, 2)
+    assert budget.level == 0
+
+    observe(budget, 1, 1)
+    assert budget.level == 1
+    assert not budget.render
+    assert budget.should_track(1)
+
+    observe(budget, 1, 3)
+    assert budget.level == 2
+    assert budget.should_track(4) and not budget.should_track(5)
+    assert budget.detect_interval(25) == 25
+
+    observe(budget, 1, 3)
+    assert budget.level == 3
+    assert budget.detect_interval(25) == 50
+
+    # The last level is the limit
+    observe(budget, 1, 10)
+    assert budget.level == 3
+    assert budget.stats()['level'] == 'stretch_detection'
+
+def test_over_budget_must_be_in_a_row():
+    budget = LatencyBudget(0.1, patience=3)
+
+    for _ in range(5):
+        observe(budget, 1, 2)
+        observe(budget, 0, 1)
+
+    assert budget.level == 0
+
+def test_recovery_is_slower():
+    budget = LatencyBudget(0.1, patience=2)
+    observe(budget, 1, 4)
+    assert budget.level == 2
+
+    observe(budget, 0, 9)
+    assert budget.level == 2
+
+    observe(budget, 0, 1)
+    assert budget.level == 1
+
+    observe(budget, 0, 10)
+    assert budget.level == 0
+    assert budget.render
+
+def test_latency_near_budget_keeps_level():
+    budget = LatencyBudget(0.1, patience=2, recovery=0.7)
+    observe(budget, 1, 2)
+
+    # Between budget * recovery and the budget: neither over nor under
+    observe(budget, 0.09, 50)
+    assert budget.level == 1
+
+def test_stats():
+    budget = LatencyBudget(0.1, window=3)
+    assert budget.stats() == {'level': 'normal'}
+
+    observe(budget, 0.5, 5)
+    stats = budget.stats()
+
+    assert len(budget.latencies) == 3
+    assert 500 <= stats['p50'] <= stats['p95'] < 600
@@ -34,3 +34,30 @@ def rectangle(image, boxes):
         cv2.rectangle(copy, (x1, y1), (x2, y2), (255, 0, 0), 2)
     
     return copy
+
+
+def draw(image, boundary, boxes, lines):
+
+    '''
+        Shades the image outside the boundary, draws boxes
+        and writes lines of text in the bottom left corner.
+    '''
+
+    height                   = image.shape[0]
+    width                    = image.shape[1]
+    left, top, right, bottom = boundary
+
+    over = overlap(image, [0, 0, width, top], white=False)
+    over = overlap(over, [0, top, left, bottom], white=False)
+    over = overlap(over, [0, bottom, width, height], white=False)
+    over = overlap(over, [right, top, width, bottom], white=False)
+
+    for box in boxes:
+        x1, y1, x2, y2 = box
+        cv2.rectangle(over, (x1, y1), (x2, y2), (8, 67, 226), 2)
+
+    for i, line in enumerate(reversed(lines)):
+        org = (50, height - 100 - i * 100)
+        cv2.putText(over, line, org, cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2, cv2.LINE_AA)
+
+    return over
@@ -0,0 +1,308 @@
+from multiprocessing import shared_memory
+from detection import Detector, PROFILES
+import multiprocessing
+import numpy as np
+import threading
+import itertools
+import pickle
+import queue
+import sys
+import os
+import cv2
+
+
+#===========================#
+#                           #
+#         Functions         #
+#                           #
+#===========================#
+
+def pack(detected):
+
+    '''
+        Converts detector output to array [N, 6]:
+        (index, confidence, left, top, right, bottom).
+        For Detector.decode the box is (left, top, width, height).
+    '''
+
+    indices, boxes, confs = detected
+    packed = np.zeros((len(indices), 6), dtype=np.float32)
+
+    for i, (index, box, conf) in enumerate(zip(indices, boxes, confs)):
+        packed[i, 0]  = index
+        packed[i, 1]  = conf
+        packed[i, 2:] = box
+
+    return packed
+
+def unpack(packed):
+    indices = [int(row[0]) for row in packed]
+    confs   = [float(row[1]) for row in packed]
+    boxes   = [[int(value) for value in row[2:]] for row in packed]
+    return indices, boxes, confs
+
+def attach(name):
+
+    # Slots are owned by the pool, workers must not unlink them
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    # Workers inherit the resource tracker of the pool with every
+    # start method, so attaching only repeats the pool's registration.
+    # Unregistering here would drop the pool's own one.
+    return shared_memory.SharedMemory(name=name)
+
+def portable(error):
+
+    # Exceptions travel through a queue. One, which can't be
+    # pickled, would be lost there and the caller would wait forever
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f'{type(error).__name__}: {error}')
+
+def work(names, shape, tasks, results, weights, config, options, threads):
+
+    # Threads of cv2 are shared between the processes. Every task
+    # tells how many of them this worker may use (see DetectorPool.submit)
+    cv2.setNumThreads(threads)
+
+    memory   = [attach(name) for name in names]
+    blobs    = [np.ndarray(shape, dtype=np.float32, buffer=m.buf) for m in memory]
+    failure  = None
+    parent   = os.getppid()
+
+    # If the network can't be loaded, the worker answers
+    # every task with this error instead of exiting silently
+    try:
+        detector = Detector(weights, config, **options)
+        detector.warmup(shape[2])
+    except Exception as error:
+        failure = portable(error)
+
+    while True:
+
+        # If the pool crashed without close(), the worker must exit too.
+        # Otherwise it keeps the resource tracker alive and the shared
+        # memory is never unlinked.
+        try:
+            task = tasks.get(timeout=1)
+        except queue.Empty:
+            if os.getppid() != parent:
+                break
+            continue
+
+        if task is None:
+            break
+
+        job, slot, method, threshold, nms_threshold, thresholds, limit = task
+
+        if failure is not None:
+            results.put((job, slot, failure))
+            continue
+
+        if limit != threads:
+            threads = limit
+            cv2.setNumThreads(threads)
+
+        try:
+            if method == 'decode':
+                detected = detector.decode(blobs[slot], threshold, thresholds)
+            else:
+                detected = detector(blobs[slot], threshold, nms_threshold)
+
+            results.put((job, slot, pack(detected)))
+        except Exception as error:
+            results.put((job, slot, portable(error)))
+
+    del blobs
+
+    for m in memory:
+        m.close()
+
+
+#===========================#
+#                           #
+#         Classes           #
+#                           #
+#===========================#
+
+class DetectorPool:
+
+    def __init__(self, weights, config, size=608, workers=None, slots=None, timeout=1,
+                 **options):
+
+        '''
+            weights:    Path to yolo.weights
+
+            config:     Path to yolo.cfg
+
+            size:       Integer (320, 416, 512, 608).
+                        Must match Transform.size.
+
+            workers:    Number of processes. Default is the CPU count.
+
+            slots:      Number of shared memory blobs. Default is
+                        two per worker, so the next blob can be written
+                        while the previous one is processed.
+
+            timeout:    Seconds between checks, that all
+                        workers are still alive.
+
+            options:    Keyword arguments of Detector
+                        (target, backend, device, precision, thresholds).
+
+            Calls are synchronous, like Detector.__call__. Several
+            blobs can be in flight with submit and result. The pool
+            is thread-safe, so one pool can serve several streams.
+            The CPU threads are split between the blobs in flight:
+            a single blob gets all of them.
+        '''
+
+        assert size in PROFILES, 'SIZE must be one of PROFILES.'
+
+        workers = workers or os.cpu_count() or 1
+        slots   = slots or workers * 2
+
+        assert slots >= workers, 'SLOTS must not be less than WORKERS.'
+
+        self.timeout   = timeout
+        self.workers   = workers
+        self.cores     = os.cpu_count() or 1
+        self.shape     = (1, 3, size, size)
+        nbytes         = int(np.prod(self.shape)) * np.dtype(np.float32).itemsize
+        self.memory    = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(slots)]
+        self.blobs     = [np.ndarray(self.shape, dtype=np.float32, buffer=m.buf) for m in self.memory]
+        self.free      = list(range(slots))
+        self.done      = {}
+        self.jobs      = itertools.count()
+        self.tasks     = multiprocessing.Queue()
+        self.results   = multiprocessing.Queue()
+        self.condition = threading.Condition()
+        self.failure   = None
+        self.closing   = False
+        names          = [m.name for m in self.memory]
+        threads        = max(1, self.cores // workers)
+        args           = (names, self.shape, self.tasks, self.results, weights, config,
+                          options, threads)
+
+        self.processes = []
+
+        for _ in range(workers):
+            process = multiprocessing.Process(target=work, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        # Results are taken from the queue by one thread only, so callers
+        # from different threads never receive each other's results
+        self.collector = threading.Thread(target=self.collect, name='DetectorPool', daemon=True)
+        self.collector.start()
+
+    def collect(self):
+        while True:
+            try:
+                job, slot, packed = self.results.get(timeout=self.timeout)
+            except queue.Empty:
+
+                # A worker killed by the system (or a crash in cv2)
+                # never answers, so waiting longer makes no sense
+                dead = [p for p in self.processes if not p.is_alive()]
+
+                if dead and not self.closing:
+                    with self.condition:
+                        self.failure = RuntimeError(f'Detector worker exited with code {dead[0].exitcode}.')
+                        self.condition.notify_all()
+                    return
+
+                continue
+
+            # Sent by close()
+            if job is None:
+                return
+
+            with self.condition:
+                self.free.append(slot)
+                self.done.update({job: packed})
+                self.condition.notify_all()
+
+    def submit(self, blob, threshold=0.6, nms_threshold=0.4, method='call', thresholds=None):
+
+        '''
+            method:     'call' for Detector.__call__,
+                        'decode' for Detector.decode.
+        '''
+
+        with self.condition:
+
+            # All slots are busy: wait until some worker returns one
+            self.condition.wait_for(lambda: self.free or self.failure is not None)
+
+            if self.failure is not None:
+                raise self.failure
+
+            slot     = self.free.pop()
+            job      = next(self.jobs)
+            flight   = min(len(self.blobs) - len(self.free), self.workers)
+            threads  = max(1, self.cores // flight)
+
+        # The slot belongs to this caller until its result is collected
+        self.blobs[slot][...] = blob
+        self.tasks.put((job, slot, method, threshold, nms_threshold, thresholds, threads))
+        return job
+
+    def result(self, job):
+        with self.condition:
+            self.condition.wait_for(lambda: job in self.done or self.failure is not None)
+
+            if job not in self.done:
+                raise self.failure
+
+            packed = self.done.pop(job)
+
+        if isinstance(packed, Exception):
+            raise packed
+
+        return unpack(packed)
+
+    def close(self):
+        if not self.processes:
+            return
+
+        self.closing = True
+
+        for _ in self.processes:
+            self.tasks.put(None)
+
+        for process in self.processes:
+            process.join()
+
+        self.results.put((None, None, None))
+        self.collector.join()
+        self.blobs = []
+
+        for m in self.memory:
+            m.close()
+            m.unlink()
+
+        self.processes = []
+        self.memory    = []
+
+    def warmup(self, size=608):
+
+        # Every worker warms its network up on start
+        assert size == self.shape[2], 'SIZE must match the size of the pool.'
+
+    def decode(self, blob, threshold=0.6, thresholds=None):
+        job = self.submit(blob, threshold, method='decode', thresholds=thresholds)
+        return self.result(job)
+
+    def __call__(self, blob, threshold=0.6, nms_threshold=0.4):
+        job = self.submit(blob, threshold, nms_threshold)
+        return self.result(job)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()